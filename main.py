@@ -1,116 +1,300 @@
+import atexit
+import io
 import os
+import re
+import shutil
 import sys
 import subprocess
 import tempfile
+from functools import cached_property
 import yaml
-from typing import List
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from datetime import datetime
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML собран без libyaml
+    from yaml import SafeLoader
+
+try:
+    import pygit2
+except ImportError:  # Без pygit2 история читается через git log
+    pygit2 = None
+
+# Формат commit_date в конфигурации
+DATE_RE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+# Переменная окружения с путём к RAM-диску для клона (например, на Windows)
+RAMDISK_ENV = 'GIT_VISUALIZER_RAMDISK'
+
+# Уже склонированные репозитории: (repo_url, commit_date) -> путь к клону
+_clone_cache: Dict[Tuple[str, str], str] = {}
+
+# Клоны-заглушки для диапазонов без коммитов: история в них не читается
+_empty_clones: Set[str] = set()
+
+# Уже прочитанные коммиты: (repo_path, commit_date) -> список коммитов
+_commits_cache: Dict[Tuple[str, str], List[dict]] = {}
+
+# Размер буфера и порции чтения вывода git log
+LOG_READ_SIZE = 1 << 20
+
+# Статусы изменений, файлы с которыми попадают в граф: удаления и прочее отбрасываются
+DIFF_FILTER = 'ACMRT'
+DIFF_STATUSES = DIFF_FILTER.encode()
+
+# Буфер записи выходного файла
+OUTPUT_BUFFER_SIZE = 1 << 23
+
+# Экранирование строк внутри rectangle "..." в PlantUML
+PUML_ESCAPE = str.maketrans({'"': '\\"', '\\': '\\\\', '\n': ' ', '\r': ' '})
+
+
+class _GitBatch:
+    """
+    Долгоживущий процесс `git cat-file --batch-check` для запросов метаданных объектов:
+    один запуск git на всё время работы вместо отдельного процесса на каждый объект.
+    """
+
+    def __init__(self, repo_path: str):
+        self.repo_path = repo_path
+        self.proc = None
+
+    def __enter__(self) -> '_GitBatch':
+        self.proc = subprocess.Popen(
+            ['git', '-C', self.repo_path, 'cat-file', '--batch-check=%(objectname) %(objecttype)'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE
+        )
+        return self
+
+    def __exit__(self, *exc_info):
+        self.proc.stdin.close()
+        self.proc.stdout.close()
+        self.proc.wait()
+
+    def query(self, rev: str) -> Optional[Tuple[str, str]]:
+        """
+        Возвращает (хеш, тип) объекта или None, если объекта нет
+        или сокращённый хеш подходит к нескольким объектам.
+        """
+        if '\n' in rev:  # Запросы разделяются переводом строки
+            raise ValueError(f"Revision must not contain a newline: {rev!r}")
+        self.proc.stdin.write(rev.encode() + b'\n')
+        self.proc.stdin.flush()
+        object_name, object_type = self.proc.stdout.readline().decode().rstrip('\n').rsplit(' ', 1)
+        if object_type in ('missing', 'ambiguous'):
+            return None
+        return object_name, object_type
+
 
 class GitVisualizer:
     def __init__(self, config: dict):
         self.repo_url = config.get("repo_url")
         self.output_file = os.path.join(os.getcwd(), config.get("output_file"))
         self.commit_date = config.get("commit_date")
-        self.repo_path = self.clone_repository()
+        # Граница истории один раз переводится в Unix-время для git и pygit2
+        self._since_epoch = (
+            int(datetime.strptime(self.commit_date, "%Y-%m-%d").timestamp()) if self.commit_date else None
+        )
+
+    @cached_property
+    def repo_path(self) -> str:
+        """
+        Путь к клону репозитория; клонирует при первом обращении.
+        """
+        return self.clone_repository()
 
     def clone_repository(self) -> str:
         """
         Клонирует репозиторий по URL во временную папку.
+        Клон bare, без блобов и (если задана commit_date) только с историей начиная с неё:
+        для построения графа нужны лишь метаданные коммитов и имена файлов.
+        Повторный вызов с теми же repo_url и commit_date возвращает готовый клон.
         """
-        temp_dir = tempfile.mkdtemp()
-        try:
-            print(f"Cloning repository from {self.repo_url} into {temp_dir}")
-            subprocess.run(['git', 'clone', self.repo_url, temp_dir], check=True)
+        key = (self.repo_url, self.commit_date)
+        cached = _clone_cache.get(key)
+        if cached and os.path.isdir(cached):
+            return cached
+
+        ramdisk = ramdisk_dir()
+        temp_dir = tempfile.mkdtemp(dir=ramdisk)
+        print(f"Cloning repository from {self.repo_url} into {temp_dir}")
+        if self._clone_into(temp_dir):
+            _clone_cache[key] = temp_dir
             return temp_dir
-        except subprocess.CalledProcessError:
+
+        # Текст ошибки сервера (no commits selected...) по HTTP до клиента
+        # не доходит, поэтому проверяем, доступен ли репозиторий вообще
+        reachable = subprocess.run(
+            ['git', 'ls-remote', '--quiet', self.repo_url, 'HEAD'],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL  # Причину ошибки git clone уже вывел
+        ).returncode == 0
+        if reachable and ramdisk is not None:
+            # На RAM-диске могло не хватить места (в Docker /dev/shm - 64 МБ по умолчанию)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            temp_dir = tempfile.mkdtemp()
+            print(f"Retrying clone into {temp_dir}")
+            if self._clone_into(temp_dir):
+                _clone_cache[key] = temp_dir
+                return temp_dir
+
+        if not reachable or self._since_epoch is None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
             print("Error: Failed to clone repository.")
             sys.exit(1)
 
+        # Репозиторий доступен - значит, после commit_date коммитов нет,
+        # и клонировать заново незачем: хватит пустого репозитория
+        print(f"No commits since {self.commit_date}")
+        subprocess.run(['git', 'init', '--quiet', '--bare', temp_dir], check=True)
+        _empty_clones.add(temp_dir)
+        _clone_cache[key] = temp_dir
+        return temp_dir
+
+    def _clone_into(self, temp_dir: str) -> bool:
+        """
+        Клонирует репозиторий в temp_dir; возвращает False, если git не справился.
+        """
+        cmd = ['git', 'clone', '--filter=blob:none', '--no-checkout', '--bare']
+        if self._since_epoch is None:
+            # Дата не задана - нужна вся история: неглубокий клон сделал бы самый
+            # старый из полученных коммитов корневым со всеми файлами репозитория
+            return subprocess.run(cmd + [self.repo_url, temp_dir]).returncode == 0
+        cmd.append(f'--shallow-since=@{self._since_epoch}')
+        if subprocess.run(cmd + [self.repo_url, temp_dir]).returncode != 0:
+            return False
+        # Догружаем родителей граничных коммитов: иначе самый старый коммит
+        # диапазона выглядит корневым и сравнивается с пустым деревом
+        return subprocess.run(['git', '-C', temp_dir, 'fetch', '--deepen=1']).returncode == 0
+
     def get_commits(self) -> List[dict]:
         """
         Получает список коммитов из репозитория, начиная с указанной даты.
+        Результат запоминается, повторные вызовы не запускают git заново.
         """
-        os.chdir(self.repo_path)
-        try:
-            cmd = [
-                'git',
-                'log',
-                f'--since={self.commit_date}',
-                '--name-only',
-                '--pretty=format:%H|%s|%P'
-            ]
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, text=True, check=True)
-            commits = []
-            current_commit = None
-
-            for line in result.stdout.strip().split('\n'):
-                if line == '':
-                    continue
-                if '|' in line:  # Начало нового коммита
-                    if current_commit:  # Сохраняем предыдущий коммит
-                        commits.append(current_commit)
-                    parts = line.split('|', 2)
-                    commit_hash, message, parent_hashes = parts if len(parts) == 3 else (*parts, '')
-                    parents = parent_hashes.strip().split()
-                    current_commit = {
-                        'hash': commit_hash,
-                        'message': message,
-                        'parents': parents,
-                        'files': []
-                    }
-                else:
-                    current_commit['files'].append(line.strip())  # Собираем связанные файлы
-
-            if current_commit:  # Добавляем последний коммит
-                commits.append(current_commit)
-
-            return commits
-        finally:
-            os.chdir(os.getcwd())
+        key = (self.repo_path, self.commit_date)
+        commits = _commits_cache.get(key)
+        if commits is None:
+            commits = _commits_cache[key] = list(self.iter_commits())
+        return list(commits)
+
+    def iter_commits(self) -> Iterator[dict]:
+        """
+        Отдаёт коммиты по мере обхода истории: через pygit2, если он установлен,
+        иначе по мере чтения вывода git log, не буферизуя его целиком.
+        """
+        if self.repo_path in _empty_clones:
+            return
+
+        if pygit2 is not None:
+            yield from self._iter_commits_pygit2()
+            return
+
+        cmd = [
+            'git',
+            '-C',
+            self.repo_path,
+            'log',
+            '--date-order',
+            '--raw',
+            '--no-renames',
+            # Слияния сравниваются с первым родителем; --first-parent не подходит,
+            # так как в git log он ещё и отбрасывает коммиты влитых веток
+            '--diff-merges=first-parent',
+            '-z',
+            '--pretty=format:%H%x00%s%x00%P%x00'
+        ]
+        if self._since_epoch is not None:
+            cmd.append(f'--since=@{self._since_epoch}')
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=LOG_READ_SIZE) as proc:
+            yield from parse_log(read_fields(proc.stdout))
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+    def _iter_commits_pygit2(self) -> Iterator[dict]:
+        """
+        Обходит историю в процессе через libgit2, сравнивая дерево коммита
+        с деревом первого родителя, как git log --diff-merges=first-parent.
+        """
+        repo = pygit2.Repository(self.repo_path)
+        for commit in repo.walk(repo.head.target, pygit2.GIT_SORT_TOPOLOGICAL | pygit2.GIT_SORT_TIME):
+            if self._since_epoch is not None and commit.commit_time < self._since_epoch:
+                continue
+            parents = [str(parent_id) for parent_id in commit.parent_ids]
+            if parents:
+                diff = repo[parents[0]].tree.diff_to_tree(commit.tree)
+            else:  # Корневой коммит
+                diff = commit.tree.diff_to_tree(swap=True)
+            files = [delta.new_file.path for delta in diff.deltas if delta.status_char() in DIFF_FILTER]
+            yield {
+                'hash': str(commit.id),
+                'message': commit_subject(commit.raw_message, commit.message_encoding),
+                'parents': parents,
+                'files': files
+            }
 
     def build_graph(self, commits: List[dict]) -> str:
         """
         Строит граф в формате PlantUML, отображающий связи коммитов, файлов и папок.
         """
-        graph = ['@startuml']
-        graph.append('skinparam rectangle {')
-        graph.append('   BackgroundColor #FDF6E3')
-        graph.append('}')
+        buf = io.StringIO()
+        w = buf.write
+        w('@startuml\n'
+          'skinparam rectangle {\n'
+          '   BackgroundColor #FDF6E3\n'
+          '}\n')
 
-        commit_defs = {}
+        commits = commits[::-1]  # От старых к новым; список вызывающего не меняем
+        commit_idx = {commit['hash']: idx for idx, commit in enumerate(commits, 1)}
+        get_commit_idx = commit_idx.get
         file_defs = {}
+        get_file_id = file_defs.get
+        next_file_id = 0
+        edges = io.StringIO()
+        edge = edges.write
 
-        for idx, commit in enumerate(reversed(commits)):
-            commit_id = f'Commit{idx + 1}'
-            commit_defs[commit['hash']] = commit_id
-            graph.append(f'rectangle "{commit["message"]}" as {commit_id}')
+        for idx, commit in enumerate(commits, 1):
+            commit_id = f'Commit{idx}'
+            w(f'rectangle "{commit["message"].translate(PUML_ESCAPE)}" as {commit_id}\n')
 
             # Добавляем файлы и папки, связанные с этим коммитом
             for file_path in commit['files']:
-                if file_path not in file_defs:
-                    file_id = f'File{len(file_defs) + 1}'
-                    file_defs[file_path] = file_id
-                    graph.append(f'rectangle "{file_path}" as {file_id}')
-                graph.append(f'{commit_id} --> {file_defs[file_path]}')
-
-        # Добавляем связи между коммитами
-        for commit in reversed(commits):
-            child_id = commit_defs[commit['hash']]
+                file_id = get_file_id(file_path)
+                if file_id is None:
+                    next_file_id += 1
+                    file_id = file_defs[file_path] = f'File{next_file_id}'
+                    w(f'rectangle "{file_path.translate(PUML_ESCAPE)}" as {file_id}\n')
+                w(f'{commit_id} --> {file_id}\n')
+
+            # Связи между коммитами копим отдельно, они идут после всех описаний
             for parent_hash in commit['parents']:
-                if parent_hash in commit_defs:
-                    parent_id = commit_defs[parent_hash]
-                    graph.append(f'{parent_id} <|-- {child_id}')
+                parent_idx = get_commit_idx(parent_hash)
+                if parent_idx is not None:
+                    edge(f'Commit{parent_idx} <|-- {commit_id}\n')
 
-        graph.append('@enduml')
-        return '\n'.join(graph)
+        return buf.getvalue() + edges.getvalue() + '@enduml'
 
     def save_output(self, content: str):
         """
         Сохраняет сгенерированный PlantUML-код в файл.
+        Пишет во временный файл рядом и подменяет им целевой, чтобы при сбое
+        не остался наполовину записанный результат.
         """
-        with open(self.output_file, 'w') as file:
-            file.write(content)
+        # Уникальное имя, чтобы одновременные запуски не писали в один и тот же файл
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(self.output_file), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', buffering=OUTPUT_BUFFER_SIZE, encoding='utf-8', newline='\n') as file:
+                file.write(content)
+            # mkstemp создаёт файл с правами 0600, возвращаем обычные с учётом umask
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_file, 0o666 & ~umask)
+            os.replace(tmp_file, self.output_file)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
         print(f"PlantUML code has been written to {self.output_file}")
 
     def run(self):
@@ -119,13 +303,98 @@ class GitVisualizer:
         self.save_output(graph_content)
 
 
+def ramdisk_dir() -> Optional[str]:
+    """
+    Возвращает папку в оперативной памяти для временного клона или None,
+    если её нет: тогда клон ляжет в обычную временную папку.
+    """
+    for path in (os.environ.get(RAMDISK_ENV), '/dev/shm'):
+        if path and os.path.isdir(path) and os.access(path, os.W_OK):
+            return path
+    return None
+
+
+def remove_clones():
+    """
+    Удаляет временные клоны; вызывается при завершении процесса,
+    чтобы клоны не оставались в RAM-диске до перезагрузки.
+    """
+    for path in _clone_cache.values():
+        shutil.rmtree(path, ignore_errors=True)
+    _clone_cache.clear()
+
+
+atexit.register(remove_clones)
+
+
+def commit_subject(raw_message: bytes, encoding: Optional[str] = None) -> str:
+    """
+    Возвращает тему коммита так же, как %s в git log: строки первого абзаца
+    без хвостовых пробелов, склеенные через пробел.
+    """
+    try:
+        message = raw_message.decode(encoding or 'utf-8', 'replace')
+    except LookupError:  # Кодировка из заголовка коммита Python неизвестна
+        message = raw_message.decode('utf-8', 'replace')
+    lines = []
+    for line in message.split('\n'):
+        line = line.rstrip(' \t\r')
+        if line:
+            lines.append(line)
+        elif lines:  # Пустая строка закрывает первый абзац
+            break
+    return ' '.join(lines)
+
+
+def read_fields(stream: BinaryIO, chunk_size: int = LOG_READ_SIZE) -> Iterator[bytes]:
+    """
+    Читает поток порциями и отдаёт поля, разделённые NUL.
+    """
+    tail = b''
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        fields = (tail + chunk).split(b'\0')
+        tail = fields.pop()  # Поле может продолжиться в следующей порции
+        yield from fields
+    if tail:
+        yield tail
+
+
+def parse_log(fields: Iterable[bytes]) -> Iterator[dict]:
+    """
+    Разбирает вывод `git log -z --raw`, разбитый по NUL.
+    Каждый коммит - это поля хеш, сообщение, родители, затем пары
+    "статус --raw" / путь и пустое поле в конце.
+    """
+    fields = iter(fields)
+    for commit_hash in fields:
+        if not commit_hash:  # Хвост вывода
+            continue
+        message = next(fields, b'')
+        parent_hashes = next(fields, b'')
+        files = []
+        for status in fields:
+            if not status:
+                break
+            path = next(fields)  # За статусом --raw следует путь
+            # --diff-filter у git log выкинул бы коммиты без подходящих изменений,
+            # поэтому статус проверяем здесь (без --find-renames он из одной буквы)
+            if status[-1:] in DIFF_STATUSES:
+                files.append(os.fsdecode(path))
+        yield {
+            'hash': commit_hash.decode('ascii'),
+            'message': message.decode('utf-8', 'replace'),
+            'parents': parent_hashes.decode('ascii').split(),
+            'files': files
+        }
+
+
 def load_config(config_file: str) -> dict:
     """
     Загружает конфигурацию из YAML-файла.
     """
     try:
         with open(config_file, 'r') as file:
-            return yaml.safe_load(file)
+            return yaml.load(file, Loader=SafeLoader)
     except FileNotFoundError:
         print(f"Error: Configuration file {config_file} not found.")
         sys.exit(1)
@@ -144,11 +413,13 @@ if __name__ == '__main__':
     config = load_config(config_file)
 
     # Проверяем формат даты
-    try:
-        datetime.strptime(config.get("commit_date"), "%Y-%m-%d")
-    except ValueError:
+    if not DATE_RE.fullmatch(config.get("commit_date") or ""):
         print("Error: commit_date must be in the format YYYY-MM-DD")
         sys.exit(1)
 
-    visualizer = GitVisualizer(config)
+    try:
+        visualizer = GitVisualizer(config)
+    except ValueError:  # Формат верный, но такой даты нет (например, 2024-02-30)
+        print("Error: commit_date must be in the format YYYY-MM-DD")
+        sys.exit(1)
     visualizer.run()
@@ -3,35 +3,43 @@ import os
 import tempfile
 import shutil
 import yaml
-from main import GitVisualizer, load_config
+from unittest import mock
+from main import GitVisualizer, _GitBatch, load_config, pygit2
 
 
 class TestGitVisualizer(unittest.TestCase):
-    def setUp(self):
+    @classmethod
+    def setUpClass(cls):
         """
-        Создает временную папку для вывода результатов и временный YAML файл конфигурации.
+        Создает временную папку для вывода результатов, временный YAML файл конфигурации
+        и один общий для всех тестов GitVisualizer, чтобы репозиторий клонировался один раз.
         """
-        self.temp_dir = tempfile.mkdtemp()
-        self.test_repo_url = "https://github.com/see12357/ConfigDZ-2.git"  # Пример публичного репозитория
-        self.test_output_file = "test.puml"
-        self.test_commit_date = "2024-11-15"
-        self.config_path = os.path.join(self.temp_dir, "config.yaml")
-        self.output_path = os.path.join(self.temp_dir, self.test_output_file)
+        cls.temp_dir = tempfile.mkdtemp()
+        cls.test_repo_url = "https://github.com/see12357/ConfigDZ-2.git"  # Пример публичного репозитория
+        cls.test_output_file = "test.puml"
+        cls.test_commit_date = "2024-11-15"
+        cls.config_path = os.path.join(cls.temp_dir, "config.yaml")
+        cls.output_path = os.path.join(cls.temp_dir, cls.test_output_file)
 
         # Создание временного YAML-файла конфигурации
         config_data = {
-            "repo_url": self.test_repo_url,
-            "output_file": self.test_output_file,
-            "commit_date": self.test_commit_date,
+            "repo_url": cls.test_repo_url,
+            "output_file": cls.test_output_file,
+            "commit_date": cls.test_commit_date,
         }
-        with open(self.config_path, 'w') as config_file:
+        with open(cls.config_path, 'w') as config_file:
             yaml.dump(config_data, config_file)
 
-    def tearDown(self):
+        cls.visualizer = GitVisualizer(load_config(cls.config_path))
+
+    @classmethod
+    def tearDownClass(cls):
         """
-        Удаляет временную папку и все её содержимое.
+        Удаляет временную папку со всем содержимым и общий клон репозитория.
         """
-        shutil.rmtree(self.temp_dir)
+        shutil.rmtree(cls.temp_dir)
+        if 'repo_path' in vars(cls.visualizer):
+            shutil.rmtree(cls.visualizer.repo_path, ignore_errors=True)
 
     def test_load_config(self):
         """
@@ -42,48 +50,95 @@ class TestGitVisualizer(unittest.TestCase):
         self.assertEqual(config['output_file'], self.test_output_file)
         self.assertEqual(config['commit_date'], self.test_commit_date)
 
+    def test_init_does_not_clone(self):
+        """
+        Тестирует, что создание GitVisualizer не клонирует репозиторий до обращения к repo_path.
+        """
+        visualizer = GitVisualizer(load_config(self.config_path))
+        self.assertNotIn('repo_path', vars(visualizer))
+
     def test_clone_repository(self):
         """
         Тестирует клонирование репозитория.
         """
-        config = load_config(self.config_path)
-        visualizer = GitVisualizer(config)
-        self.assertTrue(os.path.exists(visualizer.repo_path))
-        self.assertTrue(os.path.isdir(visualizer.repo_path))
+        self.assertTrue(os.path.exists(self.visualizer.repo_path))
+        self.assertTrue(os.path.isdir(self.visualizer.repo_path))
 
     def test_get_commits(self):
         """
         Тестирует получение списка коммитов.
         """
-        config = load_config(self.config_path)
-        visualizer = GitVisualizer(config)
-        commits = visualizer.get_commits()
+        commits = self.visualizer.get_commits()
         self.assertIsInstance(commits, list)
         self.assertTrue(len(commits) > 0)
         self.assertIn('hash', commits[0])
         self.assertIn('message', commits[0])
         self.assertIn('files', commits[0])
 
+    def test_get_commits_keeps_cwd(self):
+        """
+        Тестирует, что чтение истории не меняет текущую папку процесса.
+        """
+        cwd = os.getcwd()
+        commits = list(self.visualizer.iter_commits())
+        self.assertTrue(len(commits) > 0)
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_get_commits_cached(self):
+        """
+        Тестирует, что повторный вызов get_commits возвращает те же коммиты.
+        """
+        commits = self.visualizer.get_commits()
+        commits.clear()
+        self.assertEqual(self.visualizer.get_commits(), GitVisualizer(load_config(self.config_path)).get_commits())
+        self.assertTrue(len(self.visualizer.get_commits()) > 0)
+
+    @unittest.skipUnless(pygit2, "pygit2 не установлен")
+    def test_pygit2_matches_git_log(self):
+        """
+        Тестирует, что обход истории через pygit2 даёт те же коммиты, что и git log.
+        """
+        pygit2_commits = list(self.visualizer.iter_commits())
+        with mock.patch('main.pygit2', None):
+            git_commits = list(self.visualizer.iter_commits())
+        self.assertEqual(pygit2_commits, git_commits)
+
     def test_build_graph(self):
         """
         Тестирует создание графа в формате PlantUML.
         """
-        config = load_config(self.config_path)
-        visualizer = GitVisualizer(config)
-        commits = visualizer.get_commits()
-        graph_content = visualizer.build_graph(commits)
+        commits = self.visualizer.get_commits()
+        graph_content = self.visualizer.build_graph(commits)
         self.assertIsInstance(graph_content, str)
         self.assertTrue(graph_content.startswith("@startuml"))
         self.assertTrue(graph_content.endswith("@enduml"))
 
+    def test_build_graph_escapes_strings(self):
+        """
+        Тестирует экранирование кавычек, обратных слешей и переводов строк в графе.
+        """
+        commits = [{'hash': 'a' * 40, 'message': 'say "hi"\nnow', 'parents': [], 'files': ['dir\\file']}]
+        graph_content = self.visualizer.build_graph(commits)
+        self.assertIn('rectangle "say \\"hi\\" now" as Commit1', graph_content)
+        self.assertIn('rectangle "dir\\\\file" as File1', graph_content)
+
+    def test_git_batch(self):
+        """
+        Тестирует запросы метаданных объектов через git cat-file --batch-check.
+        """
+        commit_hash = self.visualizer.get_commits()[0]['hash']
+        with _GitBatch(self.visualizer.repo_path) as batch:
+            self.assertEqual(batch.query(commit_hash), (commit_hash, 'commit'))
+            self.assertIsNone(batch.query('0' * 40))
+            with self.assertRaises(ValueError):
+                batch.query(commit_hash + '\n' + commit_hash)
+
     def test_clone_repasitory(self):
         """
         Тестирует клонирование репозитория.
         """
-        config = load_config(self.config_path)
-        visualizer = GitVisualizer(config)
-        self.assertTrue(os.path.exists(visualizer.repo_path))
-        self.assertTrue(os.path.isdir(visualizer.repo_path))
+        self.assertTrue(os.path.exists(self.visualizer.repo_path))
+        self.assertTrue(os.path.isdir(self.visualizer.repo_path))
 
 if __name__ == "__main__":
     unittest.main()